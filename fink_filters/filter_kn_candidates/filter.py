@@ -32,6 +32,8 @@ from fink_utils.photometry.conversion import dc_mag
 
 from fink_filters.tester import spark_unit_tests
 
+_LOG = logging.getLogger(__name__)
+
 def kn_candidates_(
         rf_kn_vs_nonkn, rf_snia_vs_nonia, snn_snia_vs_nonia, snn_sn_vs_all, drb,
         classtar, jd, jdstarthist, ndethist, cdsxmatch) -> pd.Series:
@@ -184,6 +186,11 @@ def kn_candidates(
         classtar, jd, jdstarthist, ndethist, cdsxmatch
     )
 
+    error_message = """
+    {} is not defined as env variable
+    if an alert has passed the filter,
+    the message has not been sent to Slack
+    """
     if f_kn.any():
         # Galactic latitude transformation
         b = SkyCoord(
@@ -217,6 +224,22 @@ def kn_candidates(
         fid = np.array(fid.astype(int)[f_kn])
         jd = np.array(jd)[f_kn]
 
+        # Webhooks, read once for all candidates
+        kn_urls = []
+        for url_name in ['KNWEBHOOK', 'KNWEBHOOK_FINK']:
+            if url_name in os.environ:
+                kn_urls.append(os.environ[url_name])
+            else:
+                _LOG.warning(error_message.format(url_name))
+
+        ama_url = os.environ.get('KNWEBHOOK_AMA_CL')
+        if ama_url is None:
+            _LOG.warning(error_message.format('KNWEBHOOK_AMA_CL'))
+
+        # Send alerts to amateurs only on Friday
+        # Monday is 1 and Sunday is 7
+        is_friday = (datetime.datetime.utcnow().isoweekday() == 5)
+
     dict_filt = {1: 'g', 2: 'r'}
     for i, alertID in enumerate(objectId[f_kn]):
         # Careful - Spark casts None as NaN!
@@ -326,45 +349,25 @@ def kn_candidates(
             },
         ]
 
-        error_message = """
-        {} is not defined as env variable
-        if an alert has passed the filter,
-        the message has not been sent to Slack
-        """
-        for url_name in ['KNWEBHOOK', 'KNWEBHOOK_FINK']:
-            if (url_name in os.environ):
-                requests.post(
-                    os.environ[url_name],
-                    json={
-                        'blocks': blocks,
-                        'username': 'Classifier-based kilonova bot'
-                    },
-                    headers={'Content-Type': 'application/json'},
-                )
-            else:
-                log = logging.Logger('Kilonova filter')
-                log.warning(error_message.format(url_name))
-
-        ama_in_env = ('KNWEBHOOK_AMA_CL' in os.environ)
-
-        # Send alerts to amateurs only on Friday
-        now = datetime.datetime.utcnow()
-
-        # Monday is 1 and Sunday is 7
-        is_friday = (now.isoweekday() == 5)
+        for url in kn_urls:
+            requests.post(
+                url,
+                json={
+                    'blocks': blocks,
+                    'username': 'Classifier-based kilonova bot'
+                },
+                headers={'Content-Type': 'application/json'},
+            )
 
-        if (np.abs(b[i]) > 20) & (mag < 20) & is_friday & ama_in_env:
+        if (np.abs(b[i]) > 20) & (mag < 20) & is_friday & (ama_url is not None):
             requests.post(
-                os.environ['KNWEBHOOK_AMA_CL'],
+                ama_url,
                 json={
                     'blocks': blocks,
                     'username': 'Classifier-based kilonova bot'
                 },
                 headers={'Content-Type': 'application/json'},
             )
-        else:
-            log = logging.Logger('Kilonova filter')
-            log.warning(error_message.format(url_name))
 
     return f_kn
 
@@ -19,9 +19,9 @@ import numpy as np
 import pandas as pd
 import datetime
 import requests
+from concurrent.futures import ThreadPoolExecutor
 import os
 import logging
-from scipy.optimize import curve_fit
 
 from astropy.coordinates import SkyCoord
 from astropy.coordinates import Angle
@@ -29,10 +29,512 @@ from astropy import units as u
 from astropy.time import Time
 from astroquery.sdss import SDSS
 
-from fink_utils.photometry.conversion import dc_mag
+from fink_utils.photometry.vect_conversion import vect_dc_mag
 
 from fink_filters.tester import spark_unit_tests
 
+_LIST_SIMBAD_GALAXIES = [
+    "galaxy",
+    "Galaxy",
+    "EmG",
+    "Seyfert",
+    "Seyfert_1",
+    "Seyfert_2",
+    "BlueCompG",
+    "StarburstG",
+    "LSB_G",
+    "HII_G",
+    "High_z_G",
+    "GinPair",
+    "GinGroup",
+    "BClG",
+    "GinCl",
+    "PartofG",
+]
+
+_KEEP_CDS = frozenset(
+    ["Unknown", "Transient", "Fail"] + _LIST_SIMBAD_GALAXIES
+)
+
+# Last row of the ICRS to Galactic rotation matrix (same as astropy)
+_ICRS_TO_GALACTIC_Z = np.array(
+    [-0.8676661375596587, -0.19807633727300075, 0.4559838136873016]
+)
+
+_LOG = logging.getLogger(__name__)
+
+_SESSION = requests.Session()
+
+def galactic_latitude(ra, dec) -> np.array:
+    """ Galactic latitude of ICRS coordinates
+
+    NumPy equivalent of `SkyCoord(ra, dec, unit='deg').galactic.b.deg`,
+    without the overhead of the astropy frame machinery.
+
+    Parameters
+    ----------
+    ra: np.array of float
+        Right ascension [deg]
+    dec: np.array of float
+        Declination [deg]
+
+    Returns
+    ----------
+    b: np.array of float
+        Galactic latitude [deg]
+
+    Examples
+    ----------
+    >>> ra = np.array([0., 83.63, 192.86, 266.40])
+    >>> dec = np.array([0., 22.01, 27.13, -28.94])
+    >>> b_astropy = SkyCoord(ra, dec, unit='deg').galactic.b.deg
+    >>> assert np.allclose(galactic_latitude(ra, dec), b_astropy)
+
+    Rounding errors do not produce NaN at the galactic poles
+    >>> ra = np.array([192.8594779613049, 12.859477969480595])
+    >>> dec = np.array([27.12825237988064, -27.12825248662002])
+    >>> assert np.allclose(galactic_latitude(ra, dec), [90., -90.], atol=1e-5)
+    """
+    ra = np.radians(ra)
+    dec = np.radians(dec)
+    z = _ICRS_TO_GALACTIC_Z[0] * np.cos(dec) * np.cos(ra) \
+        + _ICRS_TO_GALACTIC_Z[1] * np.cos(dec) * np.sin(ra) \
+        + _ICRS_TO_GALACTIC_Z[2] * np.sin(dec)
+
+    # rounding errors can push z slightly out of [-1, 1] at the poles
+    return np.degrees(np.arcsin(np.clip(z, -1., 1.)))
+
+def post_message(url, payload):
+    """ Post a message to a Slack webhook, reusing the module session
+
+    Network errors are logged, and do not interrupt the filter.
+
+    Parameters
+    ----------
+    url: str
+        Slack webhook url
+    payload: dict
+        Message to send, as expected by the Slack API
+
+    Returns
+    ----------
+    out: requests.Response or None
+        Response of the Slack API, None if the request failed
+    """
+    try:
+        return _SESSION.post(
+            url,
+            json=payload,
+            headers={'Content-Type': 'application/json'},
+            timeout=5
+        )
+    except requests.RequestException as e:
+        # the exception message contains the (secret) webhook url
+        _LOG.warning(
+            'Failed to post a message to Slack: {}'.format(type(e).__name__)
+        )
+        return None
+
+def make_blocks(
+        alertID, scores, iso, delta_jd_last, delta_jd_first, band, mag,
+        err_mag, rate, sigma_rate, ra, dec, b) -> list:
+    """ Slack message blocks describing a rate-based KN candidate
+
+    Parameters
+    ----------
+    alertID: str
+        ZTF object ID
+    scores: tuple of float
+        'Early SN Ia', 'Ia SN vs non-Ia SN' and
+        'SN Ia and Core-Collapse vs non-SN events' scores
+    iso: str
+        Date of the alert, ISO format
+    delta_jd_last, delta_jd_first: float
+        Time since last and first detections [days]
+    band: str
+        Filter name of the measurement
+    mag, err_mag: float
+        Apparent magnitude and its error
+    rate, sigma_rate: float
+        Magnitude rate [mag/day] and its error
+    ra, dec: float
+        Coordinates of the alert [deg]
+    b: float
+        Galactic latitude of the alert [deg]
+
+    Returns
+    ----------
+    blocks: list of dict
+        Message blocks, as expected by the Slack API
+    """
+    ra_formatted = Angle(ra * u.degree).to_string(
+        precision=2, sep=' ', unit=u.hour
+    )
+    dec_formatted = Angle(dec * u.degree).to_string(
+        precision=1, sep=' ', alwayssign=True
+    )
+
+    # information to send
+    alert_text = f"""
+            *New kilonova candidate:* <http://134.158.75.151:24000/{alertID}|{alertID}>
+            """
+    score_text = f"""
+            *Scores:*\n- Early SN Ia: {scores[0]:.2f}\n- Ia SN vs non-Ia SN: {scores[1]:.2f}\n- SN Ia and Core-Collapse vs non-SN: {scores[2]:.2f}
+            """
+    time_text = f"""
+            *Time:*\n- {iso} UTC\n - Time since last detection: {delta_jd_last:.1f} days\n - Time since first detection: {delta_jd_first:.1f} days
+            """
+    measurements_text = f"""
+            *Measurement (band {band}):*\n- Apparent magnitude: {mag:.2f} ± {err_mag:.2f} \n- Rate: ({rate:.2f} ± {sigma_rate:.2f}) mag/day\n
+            """
+    radec_text = f"""
+              *RA/Dec:*\n- [hours, deg]: {ra_formatted} {dec_formatted}\n- [deg, deg]: {ra:.7f} {dec:+.7f}
+              """
+    galactic_position_text = f"""
+            *Galactic latitude:*\n- [deg]: {b:.7f}"""
+
+    tns_text = f'*TNS:* <https://www.wis-tns.org/search?ra={ra}&decl={dec}&radius=5&coords_unit=arcsec|link>'
+
+    # message formatting
+    blocks = [
+        {
+            "type": "section",
+            "fields": [
+                {
+                    "type": "mrkdwn",
+                    "text": alert_text
+                },
+            ]
+        },
+        {
+            "type": "section",
+            "fields": [
+                {
+                    "type": "mrkdwn",
+                    "text": time_text
+                },
+                {
+                    "type": "mrkdwn",
+                    "text": score_text
+                },
+                {
+                    "type": "mrkdwn",
+                    "text": radec_text
+                },
+                {
+                    "type": "mrkdwn",
+                    "text": measurements_text
+                },
+                {
+                    "type": "mrkdwn",
+                    "text": galactic_position_text
+                },
+                {
+                    "type": "mrkdwn",
+                    "text": tns_text
+                },
+            ]
+        },
+    ]
+
+    return blocks
+
+def concat_history(history, masks) -> np.array:
+    """ Concatenate the selected measurements of several alert histories
+
+    Parameters
+    ----------
+    history: np.array of arrays
+        History of one quantity, one array per alert
+    masks: list of arrays of bool
+        Measurements to keep, one mask per alert
+
+    Returns
+    ----------
+    out: np.array
+        Selected measurements of all alerts, put end to end
+    """
+    return np.concatenate(
+        [np.array(h)[m] for h, m in zip(history, masks)]
+    )
+
+def last_two(npoints, x) -> np.array:
+    """ Last two points of several series put end to end
+
+    Parameters
+    ----------
+    npoints: np.array of int
+        Number of points of each series
+    x: np.array of float
+        Coordinates of the points
+
+    Returns
+    ----------
+    out: 2D np.array of float
+        Array of shape (number of series, 2), with the before-last and
+        the last points of each series. Missing values are NaN.
+
+    Examples
+    ----------
+    >>> npoints = np.array([3, 0, 1, 2])
+    >>> x = np.array([1., 2., 4., 3., 5., 7.5])
+    >>> print(last_two(npoints, x))
+    [[ 2.   4. ]
+     [ nan  nan]
+     [ nan  3. ]
+     [ 5.   7.5]]
+    """
+    end = np.cumsum(npoints)
+
+    out = np.full((len(npoints), 2), np.nan)
+    out[npoints >= 1, 1] = x[end[npoints >= 1] - 1]
+    out[npoints >= 2, 0] = x[end[npoints >= 2] - 2]
+
+    return out
+
+def linear_fit_slopes(segment, x, y, sigma, nsegment) -> tuple:
+    """ Weighted linear fits y = a * x + b of several series at once
+
+    This is the exact weighted least-squares solution, with the variance
+    scaled by the reduced chi-square as in `np.polyfit(..., cov=True)`.
+    Coordinates are centred on the weighted mean of each series, so the
+    result stays accurate with JD ~ 2.4e6, where `scipy.optimize.curve_fit`
+    could be significantly off for small slopes.
+
+    Parameters
+    ----------
+    segment: np.array of int
+        Index of the series each point belongs to
+    x, y: np.array of float
+        Coordinates of the points
+    sigma: np.array of float
+        Errors on y
+    nsegment: int
+        Total number of series
+
+    Returns
+    ----------
+    slope: np.array of float
+        Best-fit slope of each series
+    var_slope: np.array of float
+        Variance of the slope of each series. Infinite if the series
+        has only two points.
+
+    Examples
+    ----------
+    >>> segment = np.array([0, 0, 0, 0, 1, 1])
+    >>> x = 2459000. + np.array([0.1, 1.2, 2.0, 3.5, 0.3, 2.2])
+    >>> y = np.array([18.2, 18.5, 18.7, 19.3, 20.1, 19.8])
+    >>> sigma = np.array([0.1, 0.05, 0.2, 0.1, 0.15, 0.1])
+    >>> slope, var_slope = linear_fit_slopes(segment, x, y, sigma, 2)
+
+    The slope and its variance do not depend on the origin of x, and
+    `np.polyfit` is better conditioned with times relative to the first point
+    >>> dx = x - x[0]
+    >>> p, cov = np.polyfit(dx[:4], y[:4], 1, w=1 / sigma[:4], cov=True)
+    >>> assert np.isclose(slope[0], p[0])
+    >>> assert np.isclose(var_slope[0], cov[0, 0])
+
+    Two points are fitted exactly, but the slope error is unknown
+    >>> p = np.polyfit(dx[4:], y[4:], 1, w=1 / sigma[4:])
+    >>> assert np.isclose(slope[1], p[0])
+    >>> print(var_slope[1])
+    inf
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = 1. / sigma**2
+        sw = np.bincount(segment, weights=w, minlength=nsegment)
+        xm = np.bincount(segment, weights=w * x, minlength=nsegment) / sw
+        ym = np.bincount(segment, weights=w * y, minlength=nsegment) / sw
+
+        # centering keeps the fit well-conditioned with JD ~ 2.4e6
+        dx = x - xm[segment]
+        dy = y - ym[segment]
+        sxx = np.bincount(segment, weights=w * dx**2, minlength=nsegment)
+        sxy = np.bincount(segment, weights=w * dx * dy, minlength=nsegment)
+        slope = sxy / sxx
+
+        residuals = dy - slope[segment] * dx
+        chi2 = np.bincount(
+            segment, weights=w * residuals**2, minlength=nsegment
+        )
+        dof = np.bincount(segment, minlength=nsegment) - 2
+        var_slope = np.where(dof > 0, chi2 / dof / sxx, np.inf)
+
+    return slope, var_slope
+
+def series_span(npoints, x) -> np.array:
+    """ Range of x of several series put end to end
+
+    Parameters
+    ----------
+    npoints: np.array of int
+        Number of points of each series
+    x: np.array of float
+        Coordinates of the points, sorted within each series
+
+    Returns
+    ----------
+    span: np.array of float
+        Difference between the last and the first x of each series.
+        0 for series with no point.
+
+    Examples
+    ----------
+    >>> npoints = np.array([3, 0, 1, 2])
+    >>> x = np.array([1., 2., 4., 3., 5., 7.5])
+    >>> print(series_span(npoints, x))
+    [ 3.   0.   0.   2.5]
+
+    Series can all be empty
+    >>> print(series_span(np.array([0, 0]), np.array([])))
+    [ 0.  0.]
+    """
+    end = np.cumsum(npoints)
+    start = end - npoints
+    filled = npoints > 0
+
+    span = np.zeros(len(npoints))
+    span[filled] = x[end[filled] - 1] - x[start[filled]]
+
+    return span
+
+def rate_based_kn_prefilter_(
+        drb, classtar, jd, jdstarthist, ndethist, cdsxmatch, ra, dec,
+        ssdistnr, isdiffpos) -> pd.Series:
+    """ Cuts of the rate-based KN filter that do not need the history
+
+    These are the cuts applied before the rate estimation in
+    `perform_classification`. They only use alert scalar fields.
+
+    Parameters
+    ----------
+    drb: Pandas series
+        Column containing the Deep-Learning Real Bogus score
+    classtar: Pandas series
+        Column containing the sextractor score
+    jd: Pandas series
+        Column containing the JD of the _alert_
+    jdstarthist: Pandas series
+        Column containing earliest Julian dates of epoch [days]
+    ndethist: Pandas series
+        Column containing the number of prior detections (theshold of 3 sigma)
+    cdsxmatch: Pandas series
+        Column containing the cross-match values
+    ra: Pandas series
+        Column containing the right Ascension of candidate; J2000 [deg]
+    dec: Pandas series
+        Column containing the declination of candidate; J2000 [deg]
+    ssdistnr: Pandas series
+        distance to nearest known solar system object; -999.0 if none [arcsec]
+    isdiffpos: Pandas series
+        Column containing the sign of the difference (t or f)
+
+    Returns
+    ----------
+    out: pandas.Series of bool
+        Return a Pandas DataFrame with the appropriate flag:
+        false for bad alert, and true for good alert.
+
+    Examples
+    ----------
+    >>> pdf = pd.read_parquet('datatest')
+    >>> classification = rate_based_kn_prefilter_(
+    ...     pdf['candidate'].apply(lambda x: x['drb']),
+    ...     pdf['candidate'].apply(lambda x: x['classtar']),
+    ...     pdf['candidate'].apply(lambda x: x['jd']),
+    ...     pdf['candidate'].apply(lambda x: x['jdstarthist']),
+    ...     pdf['candidate'].apply(lambda x: x['ndethist']),
+    ...     pdf['cdsxmatch'],
+    ...     pdf['candidate'].apply(lambda x: x['ra']),
+    ...     pdf['candidate'].apply(lambda x: x['dec']),
+    ...     pdf['candidate'].apply(lambda x: x['ssdistnr']),
+    ...     pdf['candidate'].apply(lambda x: x['isdiffpos']))
+    >>> print(len(pdf[classification]['objectId'].values))
+    8
+
+    Missing cross-match values do not pass the cuts
+    >>> cdsxmatch = pdf['cdsxmatch'].copy()
+    >>> cdsxmatch[pdf['objectId'] == 'ZTF21acqeepb'] = None
+    >>> classification = rate_based_kn_prefilter_(
+    ...     pdf['candidate'].apply(lambda x: x['drb']),
+    ...     pdf['candidate'].apply(lambda x: x['classtar']),
+    ...     pdf['candidate'].apply(lambda x: x['jd']),
+    ...     pdf['candidate'].apply(lambda x: x['jdstarthist']),
+    ...     pdf['candidate'].apply(lambda x: x['ndethist']),
+    ...     cdsxmatch,
+    ...     pdf['candidate'].apply(lambda x: x['ra']),
+    ...     pdf['candidate'].apply(lambda x: x['dec']),
+    ...     pdf['candidate'].apply(lambda x: x['ssdistnr']),
+    ...     pdf['candidate'].apply(lambda x: x['isdiffpos']))
+    >>> print(len(pdf[classification]['objectId'].values))
+    7
+    """
+    # Cast each column only once
+    ssdistnr = ssdistnr.to_numpy(dtype=float)
+
+    high_drb = drb.to_numpy(dtype=float) > 0.9
+    high_classtar = classtar.to_numpy(dtype=float) > 0.4
+    new_detection = \
+        jd.to_numpy(dtype=float) - jdstarthist.to_numpy(dtype=float) < 14
+    small_detection_history = ndethist.to_numpy(dtype=float) < 20
+    appeared = isdiffpos.to_numpy(dtype=object) == 't'
+    far_from_mpc = (ssdistnr > 10) | (ssdistnr < 0)
+    in_cds = cdsxmatch.isin(_KEEP_CDS).to_numpy()
+
+    f_kn = high_drb & high_classtar & new_detection & small_detection_history \
+        & in_cds & appeared & far_from_mpc
+
+    # Most batches have no candidate
+    if f_kn.any():
+        # galactic plane, only for alerts passing the cuts above
+        b = galactic_latitude(
+            ra[f_kn].to_numpy(dtype=float),
+            dec[f_kn].to_numpy(dtype=float)
+        )
+
+        f_kn[f_kn] = np.abs(b) > 10
+
+    return pd.Series(f_kn, index=drb.index)
+
+@pandas_udf(BooleanType(), PandasUDFType.SCALAR)
+def rate_based_kn_prefilter(
+        drb, classtar, jd, jdstarthist, ndethist, cdsxmatch, ra, dec,
+        ssdistnr, isdiffpos) -> pd.Series:
+    """ Pandas UDF for rate_based_kn_prefilter_
+
+    The full `rate_based_kn_candidates` filter needs the alert history
+    (about twenty columns, most of them arrays) to be sent from the JVM to
+    Python. This filter only uses scalar fields and drops most alerts, so
+    apply it first and run `rate_based_kn_candidates` on the remaining
+    alerts only: the history is then serialised for a few rows per batch.
+
+    Parameters
+    ----------
+    drb, classtar, jd, jdstarthist, ndethist, cdsxmatch, ra, dec, ssdistnr, isdiffpos: Spark DataFrame Columns
+        See rate_based_kn_prefilter_
+
+    Returns
+    ----------
+    out: pandas.Series of bool
+        Return a Pandas DataFrame with the appropriate flag:
+        false for bad alert, and true for good alert.
+
+    Examples
+    ----------
+    >>> from fink_utils.spark.utils import apply_user_defined_filter
+    >>> df = spark.read.format('parquet').load('datatest')
+    >>> f = 'fink_filters.filter_rate_based_kn_candidates.filter.rate_based_kn_prefilter'
+    >>> df = apply_user_defined_filter(df, f)
+    >>> print(df.count())
+    8
+    """
+    series = rate_based_kn_prefilter_(
+        drb, classtar, jd, jdstarthist, ndethist, cdsxmatch, ra, dec,
+        ssdistnr, isdiffpos
+    )
+    return series
+
 def perform_classification(
         objectId, rf_snia_vs_nonia, snn_snia_vs_nonia, snn_sn_vs_all, drb,
         classtar, jdstarthist, ndethist, cdsxmatch, ra, dec, ssdistnr, cjdc,
@@ -79,106 +581,94 @@ def perform_classification(
         false for bad alert, and true for good alert.
     """
     # Extract last (new) measurement from the concatenated column
-    jd = cjdc.apply(lambda x: x[-1])
-    fid = cfidc.apply(lambda x: x[-1])
-    isdiffpos = cisdiffposc.apply(lambda x: x[-1])
-
-    high_drb = drb.astype(float) > 0.9
-    high_classtar = classtar.astype(float) > 0.4
-    new_detection = jd.astype(float) - jdstarthist.astype(float) < 14
-    small_detection_history = ndethist.astype(float) < 20
-    appeared = isdiffpos.astype(str) == 't'
-    far_from_mpc = (ssdistnr.astype(float) > 10) | (ssdistnr.astype(float) < 0)
-
-    # galactic plane
-    b = SkyCoord(ra.astype(float), dec.astype(float), unit='deg').galactic.b.deg
-
-    awaw_from_galactic_plane = np.abs(b) > 10
-
-    list_simbad_galaxies = [
-        "galaxy",
-        "Galaxy",
-        "EmG",
-        "Seyfert",
-        "Seyfert_1",
-        "Seyfert_2",
-        "BlueCompG",
-        "StarburstG",
-        "LSB_G",
-        "HII_G",
-        "High_z_G",
-        "GinPair",
-        "GinGroup",
-        "BClG",
-        "GinCl",
-        "PartofG",
-    ]
-
-    keep_cds = \
-        ["Unknown", "Transient", "Fail"] + list_simbad_galaxies
+    fid = cfidc.str[-1].to_numpy(dtype=int)
 
-    f_kn = high_drb & high_classtar & new_detection & small_detection_history
-    f_kn = f_kn & cdsxmatch.isin(keep_cds) & appeared & far_from_mpc
-    f_kn = f_kn & awaw_from_galactic_plane
+    f_kn = rate_based_kn_prefilter_(
+        drb, classtar, cjdc.str[-1], jdstarthist, ndethist, cdsxmatch,
+        ra, dec, ssdistnr, cisdiffposc.str[-1]
+    ).to_numpy()
 
     # Compute rate and error rate, get magnitude and its error
     rate = np.zeros(len(fid))
     sigma_rate = np.zeros(len(fid))
     mag = np.zeros(len(fid))
     err_mag = np.zeros(len(fid))
-    index_mask = np.argwhere(f_kn.values)
-    for i, alertID in enumerate(objectId[f_kn]):
-        # Spark casts None as NaN
-        maskNotNone = ~np.isnan(np.array(cmagpsfc[f_kn].values[i]))
-        maskFilter = np.array(cfidc[f_kn].values[i]) == np.array(fid)[f_kn][i]
-        m = maskNotNone * maskFilter
-        if sum(m) < 2:
-            continue
-        # DC mag (history + last measurement)
-        mag_hist, err_hist = np.array([
-            dc_mag(k[0], k[1], k[2], k[3], k[4], k[5], k[6])
-            for k in zip(
-                cfidc[f_kn].values[i][m],
-                cmagpsfc[f_kn].values[i][m],
-                csigmapsfc[f_kn].values[i][m],
-                cmagnrc[f_kn].values[i][m],
-                csigmagnrc[f_kn].values[i][m],
-                cmagzpscic[f_kn].values[i][m],
-                cisdiffposc[f_kn].values[i][m],
-            )
-        ]).T
-
-        # remove abnormal values
-        mask_outliers = mag_hist < 21
-        if sum(mask_outliers) < 2:
-            continue
-        jd_hist = cjdc[f_kn].values[i][m][mask_outliers]
-
-        if jd_hist[-1] - jd_hist[0] > 0.5:
-            # Compute rate
-            popt, pcov = curve_fit(
-                lambda x, a, b: a * x + b,
-                jd_hist,
-                mag_hist[mask_outliers],
-                sigma=err_hist[mask_outliers],
-            )
-            rate[index_mask[i]] = popt[0]
-            sigma_rate[index_mask[i]] = pcov[0, 0]
 
-        # Grab the last measurement and its error estimate
-        mag[index_mask[i]] = mag_hist[-1]
-        err_mag[index_mask[i]] = err_hist[-1]
+    if not f_kn.any():
+        return pd.Series(f_kn, index=drb.index), rate, sigma_rate, mag, err_mag
+
+    # Restrict the histories to the candidates once
+    index_mask = np.flatnonzero(f_kn)
+    fid_sub = fid[f_kn]
+    cjdc_sub = cjdc[f_kn].to_numpy()
+    cfidc_sub = cfidc[f_kn].to_numpy()
+    cmagpsfc_sub = cmagpsfc[f_kn].to_numpy()
+    csigmapsfc_sub = csigmapsfc[f_kn].to_numpy()
+    cmagnrc_sub = cmagnrc[f_kn].to_numpy()
+    csigmagnrc_sub = csigmagnrc[f_kn].to_numpy()
+    cmagzpscic_sub = cmagzpscic[f_kn].to_numpy()
+    cisdiffposc_sub = cisdiffposc[f_kn].to_numpy()
+
+    # Valid measurements (Spark casts None as NaN) in the band of the alert
+    masks = [
+        ~np.isnan(np.array(mags, dtype=float)) & (np.array(fids) == filt)
+        for mags, fids, filt in zip(cmagpsfc_sub, cfidc_sub, fid_sub)
+    ]
+    nvalid = np.array([np.count_nonzero(m) for m in masks])
+
+    # DC mag (history + last measurement) of all candidates at once
+    mag_hist_all, err_hist_all = vect_dc_mag(
+        concat_history(cfidc_sub, masks),
+        concat_history(cmagpsfc_sub, masks),
+        concat_history(csigmapsfc_sub, masks),
+        concat_history(cmagnrc_sub, masks),
+        concat_history(csigmagnrc_sub, masks),
+        concat_history(cmagzpscic_sub, masks),
+        concat_history(cisdiffposc_sub, masks),
+    )
+    jd_hist_all = concat_history(cjdc_sub, masks).astype(float)
+    segment = np.repeat(np.arange(len(masks)), nvalid)
+
+    # remove abnormal values
+    mask_outliers = mag_hist_all < 21
+    segment_in = segment[mask_outliers]
+    jd_hist_in = jd_hist_all[mask_outliers]
+    nkept = np.bincount(segment_in, minlength=len(masks))
+
+    # Time span of each history, once abnormal values removed
+    span = series_span(nkept, jd_hist_in)
+
+    # Compute rate
+    slope, var_slope = linear_fit_slopes(
+        segment_in,
+        jd_hist_in,
+        mag_hist_all[mask_outliers],
+        err_hist_all[mask_outliers],
+        len(masks)
+    )
+    valid = (nvalid >= 2) & (nkept >= 2)
+    fitted = valid & (span > 0.5)
+    rate[index_mask[fitted]] = slope[fitted]
+    sigma_rate[index_mask[fitted]] = var_slope[fitted]
+
+    # Grab the last measurement and its error estimate
+    last_hist = np.cumsum(nvalid) - 1
+    mag[index_mask[valid]] = mag_hist_all[last_hist[valid]]
+    err_mag[index_mask[valid]] = err_hist_all[last_hist[valid]]
 
     # filter on rate. rate is 0 where f_kn is already false.
-    f_kn = pd.Series(np.array(rate) > 0.3)
+    f_kn = rate > 0.3
 
     # check the nature of close objects in SDSS catalog
-    if f_kn.any():
-        no_star = []
-        for i in range(sum(f_kn)):
+    index_rate = np.flatnonzero(f_kn)
+    if len(index_rate) > 0:
+        no_star = np.zeros(len(index_rate), dtype=bool)
+        ra_sub = ra.iloc[index_rate].to_numpy(dtype=float)
+        dec_sub = dec.iloc[index_rate].to_numpy(dtype=float)
+        for i in range(len(index_rate)):
             pos = SkyCoord(
-                ra=np.array(ra[f_kn])[i] * u.degree,
-                dec=np.array(dec[f_kn])[i] * u.degree
+                ra=ra_sub[i] * u.degree,
+                dec=dec_sub[i] * u.degree
             )
             # for a test on "many" objects, you may wait 1s to stay under the
             # query limit.
@@ -190,12 +680,11 @@ def perform_classification(
             # types: 0: UNKNOWN, 1: STAR, 2: GALAXY, 3: QSO, 4: HIZ_QSO,
             # 5: SKY, 6: STAR_LATE, 7: GAL_EM
             to_remove_types = [1, 3, 4, 6]
-            no_star.append(
+            no_star[i] = \
                 len(np.intersect1d(type_close_objects, to_remove_types)) == 0
-            )
-        f_kn.loc[f_kn] = np.array(no_star, dtype=bool)
+        f_kn[index_rate] = no_star
 
-    return f_kn, rate, sigma_rate, mag, err_mag
+    return pd.Series(f_kn, index=drb.index), rate, sigma_rate, mag, err_mag
 
 def rate_based_kn_candidates_(
         objectId, rf_snia_vs_nonia, snn_snia_vs_nonia, snn_sn_vs_all, drb,
@@ -325,157 +814,92 @@ def rate_based_kn_candidates(
         cisdiffposc
     )
 
-    jd = cjdc.apply(lambda x: x[-1])
-    fid = cfidc.apply(lambda x: x[-1])
-
-    # galactic plane
-    b = SkyCoord(ra.astype(float), dec.astype(float), unit='deg').galactic.b.deg
+    # Nothing to notify: skip the astropy machinery
+    if not f_kn.any():
+        return f_kn
+
+    # Restrict the columns to the candidates before casting them
+    # coordinates
+    ra_sub = ra[f_kn].to_numpy(dtype=float)
+    dec_sub = dec[f_kn].to_numpy(dtype=float)
+
+    # galactic plane, for the candidates only
+    b = galactic_latitude(ra_sub, dec_sub)
+
+    # scores
+    rf_snia_vs_nonia_sub = rf_snia_vs_nonia[f_kn].to_numpy(dtype=float)
+    snn_snia_vs_nonia_sub = snn_snia_vs_nonia[f_kn].to_numpy(dtype=float)
+    snn_sn_vs_all_sub = snn_sn_vs_all[f_kn].to_numpy(dtype=float)
+
+    # time
+    fid_sub = cfidc[f_kn].str[-1].to_numpy(dtype=int)
+    jd_sub = cjdc[f_kn].str[-1].to_numpy(dtype=float)
+    delta_jd_first = jd_sub - jdstarthist[f_kn].to_numpy(dtype=float)
+    iso_sub = Time(jd_sub, format='jd').iso
+
+    # measurements
+    mag_sub = mag[f_kn]
+    rate_sub = rate[f_kn]
+    err_mag_sub = err_mag[f_kn]
+    sigma_rate_sub = sigma_rate[f_kn]
+
+    # Time since last detection (independently of the band)
+    masks = [
+        ~np.isnan(np.array(mags, dtype=float))
+        for mags in cmagpsfc[f_kn].to_numpy()
+    ]
+    jd_last_two = last_two(
+        np.array([np.count_nonzero(m) for m in masks]),
+        concat_history(cjdc[f_kn].to_numpy(), masks).astype(float)
+    )
+    delta_jd_last = jd_last_two[:, 1] - jd_last_two[:, 0]
 
-    # Simplify notations
-    if f_kn.any():
-        # coordinates
-        b = np.array(b)[f_kn]
-        ra = Angle(
-            np.array(ra.astype(float)[f_kn]) * u.degree
-        ).deg
-        dec = Angle(
-            np.array(dec.astype(float)[f_kn]) * u.degree
-        ).deg
-        ra_formatted = Angle(ra * u.degree).to_string(
-            precision=2, sep=' ', unit=u.hour
-        )
-        dec_formatted = Angle(dec * u.degree).to_string(
-            precision=1, sep=' ', alwayssign=True
-        )
-        delta_jd_first = np.array(
-            jd.astype(float)[f_kn] - jdstarthist.astype(float)[f_kn]
+    # message for candidates
+    error_message = """
+    {} is not defined as env variable
+    if an alert has passed the filter,
+    the message has not been sent to Slack
+    """
+    kn_urls = []
+    for url_name in ['KNWEBHOOK', 'KNWEBHOOK_FINK']:
+        if url_name in os.environ:
+            kn_urls.append(os.environ[url_name])
+        else:
+            _LOG.warning(error_message.format(url_name))
+
+    ama_url = os.environ.get('KNWEBHOOK_AMA_RATE')
+    if ama_url is None:
+        _LOG.warning(error_message.format('KNWEBHOOK_AMA_RATE'))
+
+    # Send alerts to amateurs only on Friday
+    # Monday is 1 and Sunday is 7
+    is_friday = (datetime.datetime.utcnow().isoweekday() == 5)
+
+    dict_filt = {1: 'g', 2: 'r'}
+    messages = []
+    for i, alertID in enumerate(objectId[f_kn].to_numpy()):
+        blocks = make_blocks(
+            alertID,
+            (rf_snia_vs_nonia_sub[i], snn_snia_vs_nonia_sub[i], snn_sn_vs_all_sub[i]),
+            iso_sub[i], delta_jd_last[i], delta_jd_first[i],
+            dict_filt[fid_sub[i]], mag_sub[i], err_mag_sub[i],
+            rate_sub[i], sigma_rate_sub[i],
+            ra_sub[i], dec_sub[i], b[i]
         )
 
-        # scores
-        rf_snia_vs_nonia = np.array(rf_snia_vs_nonia.astype(float)[f_kn])
-        snn_snia_vs_nonia = np.array(snn_snia_vs_nonia.astype(float)[f_kn])
-        snn_sn_vs_all = np.array(snn_sn_vs_all.astype(float)[f_kn])
+        payload = {
+            'blocks': blocks,
+            'username': 'Rate-based kilonova bot'
+        }
+        for url in kn_urls:
+            messages.append((url, payload))
 
-        # time
-        fid = np.array(fid.astype(int)[f_kn])
-        jd = np.array(jd)[f_kn]
+        if (np.abs(b[i]) > 20) & (mag_sub[i] < 20) & is_friday & (ama_url is not None):
+            messages.append((ama_url, payload))
 
-        # measurements
-        mag = mag[f_kn]
-        rate = rate[f_kn]
-        err_mag = err_mag[f_kn]
-        sigma_rate = sigma_rate[f_kn]
-
-    # message for candidates
-    for i, alertID in enumerate(objectId[f_kn]):
-
-        # Time since last detection (independently of the band)
-        maskNotNone = ~np.isnan(np.array(cmagpsfc[f_kn].values[i]))
-        jd_hist_allbands = np.array(np.array(cjdc[f_kn])[i])[maskNotNone]
-        delta_jd_last = jd_hist_allbands[-1] - jd_hist_allbands[-2]
-
-        # information to send
-        dict_filt = {1: 'g', 2: 'r'}
-        alert_text = """
-            *New kilonova candidate:* <http://134.158.75.151:24000/{}|{}>
-            """.format(alertID, alertID)
-        score_text = """
-            *Scores:*\n- Early SN Ia: {:.2f}\n- Ia SN vs non-Ia SN: {:.2f}\n- SN Ia and Core-Collapse vs non-SN: {:.2f}
-            """.format(rf_snia_vs_nonia[i], snn_snia_vs_nonia[i], snn_sn_vs_all[i])
-        time_text = """
-            *Time:*\n- {} UTC\n - Time since last detection: {:.1f} days\n - Time since first detection: {:.1f} days
-            """.format(Time(jd[i], format='jd').iso, delta_jd_last, delta_jd_first[i])
-        measurements_text = """
-            *Measurement (band {}):*\n- Apparent magnitude: {:.2f} ± {:.2f} \n- Rate: ({:.2f} ± {:.2f}) mag/day\n
-            """.format(dict_filt[fid[i]], mag[i], err_mag[i], rate[i], sigma_rate[i])
-        radec_text = """
-              *RA/Dec:*\n- [hours, deg]: {} {}\n- [deg, deg]: {:.7f} {:+.7f}
-              """.format(ra_formatted[i], dec_formatted[i], ra[i], dec[i])
-        galactic_position_text = """
-            *Galactic latitude:*\n- [deg]: {:.7f}""".format(b[i])
-
-        tns_text = '*TNS:* <https://www.wis-tns.org/search?ra={}&decl={}&radius=5&coords_unit=arcsec|link>'.format(ra[i], dec[i])
-        # message formatting
-        blocks = [
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": alert_text
-                    },
-                ]
-            },
-            {
-                "type": "section",
-                "fields": [
-                    {
-                        "type": "mrkdwn",
-                        "text": time_text
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": score_text
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": radec_text
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": measurements_text
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": galactic_position_text
-                    },
-                    {
-                        "type": "mrkdwn",
-                        "text": tns_text
-                    },
-                ]
-            },
-        ]
-
-        error_message = """
-        {} is not defined as env variable
-        if an alert has passed the filter,
-        the message has not been sent to Slack
-        """
-        for url_name in ['KNWEBHOOK', 'KNWEBHOOK_FINK']:
-            if (url_name in os.environ):
-                requests.post(
-                    os.environ[url_name],
-                    json={
-                        'blocks': blocks,
-                        'username': 'Rate-based kilonova bot'
-                    },
-                    headers={'Content-Type': 'application/json'},
-                )
-            else:
-                log = logging.Logger('Kilonova filter')
-                log.warning(error_message.format(url_name))
-
-        ama_in_env = ('KNWEBHOOK_AMA_RATE' in os.environ)
-
-        # Send alerts to amateurs only on Friday
-        now = datetime.datetime.utcnow()
-
-        # Monday is 1 and Sunday is 7
-        is_friday = (now.isoweekday() == 5)
-
-        if (np.abs(b[i]) > 20) & (mag[i] < 20) & is_friday & ama_in_env:
-            requests.post(
-                os.environ['KNWEBHOOK_AMA_RATE'],
-                json={
-                    'blocks': blocks,
-                    'username': 'Rate-based kilonova bot'
-                },
-                headers={'Content-Type': 'application/json'},
-            )
-        else:
-            log = logging.Logger('Kilonova filter')
-            log.warning(error_message.format(url_name))
+    # Send all messages concurrently, reusing the connections
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda message: post_message(*message), messages))
 
     return f_kn
 
@@ -13,12 +13,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from pyspark.sql.functions import pandas_udf, PandasUDFType
+from pyspark.sql.functions import col
 from pyspark.sql.types import BooleanType
 
 from fink_filters.tester import spark_unit_tests
 
 import pandas as pd
 
+_LIST_SIMBAD_GALAXIES = [
+    "galaxy",
+    "Galaxy",
+    "EmG",
+    "Seyfert",
+    "Seyfert_1",
+    "Seyfert_2",
+    "BlueCompG",
+    "StarburstG",
+    "LSB_G",
+    "HII_G",
+    "High_z_G",
+    "GinPair",
+    "GinGroup",
+    "BClG",
+    "GinCl",
+    "PartofG",
+]
+
+_KEEP_CDS = frozenset(
+    ["Unknown", "Candidate_SN*", "SN", "Transient", "Fail"] + _LIST_SIMBAD_GALAXIES
+)
+
 def sn_candidates_(
         cdsxmatch, snn_snia_vs_nonia, snn_sn_vs_all,
         drb, classtar, jd, jdstarthist, roid, ndethist) -> pd.Series:
@@ -69,39 +93,39 @@ def sn_candidates_(
     9
 
     >>> assert 'ZTF21acoqgmy' in pdf[classification]['objectId'].values
+
+    An alert without cross-match value is rejected
+    >>> cdsxmatch = pdf['cdsxmatch'].copy()
+    >>> cdsxmatch[pdf['objectId'] == 'ZTF21acoqgmy'] = None
+    >>> classification = sn_candidates_(
+    ...     cdsxmatch,
+    ...     pdf['snn_snia_vs_nonia'],
+    ...     pdf['snn_sn_vs_all'],
+    ...     pdf['candidate'].apply(lambda x: x['drb']),
+    ...     pdf['candidate'].apply(lambda x: x['classtar']),
+    ...     pdf['candidate'].apply(lambda x: x['jd']),
+    ...     pdf['candidate'].apply(lambda x: x['jdstarthist']),
+    ...     pdf['roid'],
+    ...     pdf['candidate'].apply(lambda x: x['ndethist']))
+    >>> print(len(pdf[classification]['objectId'].values))
+    8
+
+    >>> assert 'ZTF21acoqgmy' not in pdf[classification]['objectId'].values
     """
-    snn1 = snn_snia_vs_nonia.astype(float) > 0.5
-    snn2 = snn_sn_vs_all.astype(float) > 0.5
-    sn_history = jd.astype(float) - jdstarthist.astype(float) <= 90
-    high_drb = drb.astype(float) > 0.5
-    high_classtar = classtar.astype(float) > 0.4
-    no_mpc = roid.astype(int) != 3
-    no_first_det = ndethist.astype(int) > 1
-
-    list_simbad_galaxies = [
-        "galaxy",
-        "Galaxy",
-        "EmG",
-        "Seyfert",
-        "Seyfert_1",
-        "Seyfert_2",
-        "BlueCompG",
-        "StarburstG",
-        "LSB_G",
-        "HII_G",
-        "High_z_G",
-        "GinPair",
-        "GinGroup",
-        "BClG",
-        "GinCl",
-        "PartofG",
-    ]
-    keep_cds = \
-        ["Unknown", "Candidate_SN*", "SN", "Transient", "Fail"] + list_simbad_galaxies
-
-    f_sn = (snn1 | snn2) & cdsxmatch.isin(keep_cds) & sn_history & high_drb & high_classtar & no_first_det & no_mpc
-
-    return f_sn
+    # Cast each column once, and combine the cuts on the NumPy arrays
+    snn1 = snn_snia_vs_nonia.to_numpy(dtype=float) > 0.5
+    snn2 = snn_sn_vs_all.to_numpy(dtype=float) > 0.5
+    sn_history = \
+        jd.to_numpy(dtype=float) - jdstarthist.to_numpy(dtype=float) <= 90
+    high_drb = drb.to_numpy(dtype=float) > 0.5
+    high_classtar = classtar.to_numpy(dtype=float) > 0.4
+    no_mpc = roid.to_numpy(dtype=int) != 3
+    no_first_det = ndethist.to_numpy(dtype=int) > 1
+    in_cds = cdsxmatch.isin(_KEEP_CDS).to_numpy()
+
+    f_sn = (snn1 | snn2) & in_cds & sn_history & high_drb & high_classtar & no_first_det & no_mpc
+
+    return pd.Series(f_sn, index=jd.index)
 
 @pandas_udf(BooleanType(), PandasUDFType.SCALAR)
 def sn_candidates(
@@ -124,6 +148,43 @@ def sn_candidates(
     )
     return series
 
+def sn_candidates_spark(df):
+    """ Keep alerts considered as SN-Ia candidates, using Spark SQL only
+
+    Same cuts as sn_candidates_, but expressed as native Spark column
+    expressions. They are evaluated in the JVM like a WHERE clause,
+    so that no data is serialised to Python with Arrow, unlike with
+    the Pandas UDF `sn_candidates`.
+
+    Parameters
+    ----------
+    df: Spark DataFrame
+        Alert DataFrame, containing the `candidate` structure and the
+        cdsxmatch, snn_snia_vs_nonia, snn_sn_vs_all and roid columns.
+
+    Returns
+    ----------
+    out: Spark DataFrame
+        Input DataFrame restricted to the SN-Ia candidates
+
+    Examples
+    ----------
+    >>> df = spark.read.format('parquet').load('datatest')
+    >>> print(sn_candidates_spark(df).count())
+    9
+    """
+    snn = (col('snn_snia_vs_nonia') > 0.5) | (col('snn_sn_vs_all') > 0.5)
+    sn_history = col('candidate.jd') - col('candidate.jdstarthist') <= 90
+    high_drb = col('candidate.drb') > 0.5
+    high_classtar = col('candidate.classtar') > 0.4
+    no_mpc = col('roid').cast('int') != 3
+    no_first_det = col('candidate.ndethist').cast('int') > 1
+    in_cds = col('cdsxmatch').isin(sorted(_KEEP_CDS))
+
+    f_sn = snn & in_cds & sn_history & high_drb & high_classtar & no_first_det & no_mpc
+
+    return df.filter(f_sn)
+
 
 if __name__ == "__main__":
     """ Execute the test suite """